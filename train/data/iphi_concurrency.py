@@ -0,0 +1,128 @@
+# Copyright 2021 Thea Sommerschield, Jonathan Prag,
+# Marita Chatzipanagiotou, John Pavlopoulos, Ion Androutsopoulos,
+# University of Oxford, DeepMind Technologies Limited, Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+import numpy as np
+
+
+class ConcurrencyController:
+  '''AIMD controller for the number of concurrent PHI fetches.
+
+  Every fetch holds a slot while it is in flight. After each window of
+  `window` fetches the controller looks at the error rate and the latency
+  percentile of that window: if either is too high the limit is multiplied
+  by `decrease`, otherwise it grows by `increase`. The limit always stays
+  within [min_limit, max_limit]. An optional `max_rps` spaces out the
+  start of fetches regardless of the limit.
+  '''
+
+  def __init__(self,
+               initial,
+               min_limit=1,
+               max_limit=None,
+               max_rps=0,
+               window=20,
+               increase=1,
+               decrease=0.5,
+               max_error_rate=0.05,
+               latency_percentile=90,
+               latency_tolerance=2.):
+    if max_limit is None:
+      max_limit = initial
+    self.min_limit = max(1, min_limit)
+    self.max_limit = max(self.min_limit, max_limit)
+    self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+    self.max_rps = max_rps
+    self.window = window
+    self.increase = increase
+    self.decrease = decrease
+    self.max_error_rate = max_error_rate
+    self.latency_percentile = latency_percentile
+    self.latency_tolerance = latency_tolerance
+
+    self.in_flight = 0
+    self.requests = 0
+    self.errors = 0
+    self.baseline_latency = None
+    self._latencies = []
+    self._window_errors = 0
+    self._next_start = 0.
+    self._cond = threading.Condition()
+
+  @property
+  def adaptive(self):
+    return self.min_limit < self.max_limit
+
+  @property
+  def concurrency(self):
+    '''Current concurrency limit as an integer.'''
+    return int(self.limit)
+
+  def acquire(self):
+    '''Blocks until a fetch may start.'''
+    with self._cond:
+      while self.in_flight >= int(self.limit):
+        self._cond.wait()
+      self.in_flight += 1
+
+      # Reserve a start time to honour the requests-per-second cap.
+      delay = 0.
+      if self.max_rps > 0:
+        now = time.monotonic()
+        start = max(now, self._next_start)
+        self._next_start = start + 1. / self.max_rps
+        delay = start - now
+    if delay > 0:
+      time.sleep(delay)
+
+  def release(self, latency, error=False):
+    '''Records the outcome of a fetch and frees its slot.'''
+    with self._cond:
+      self.in_flight -= 1
+      self.requests += 1
+      if error:
+        self.errors += 1
+        self._window_errors += 1
+      else:
+        self._latencies.append(latency)
+      if len(self._latencies) + self._window_errors >= self.window:
+        self._update()
+      self._cond.notify_all()
+
+  def _update(self):
+    '''Applies one AIMD step from the current window.'''
+    n = len(self._latencies) + self._window_errors
+    error_rate = self._window_errors / n
+
+    slow = False
+    if self._latencies:
+      latencies = np.asarray(self._latencies)
+      median = float(np.median(latencies))
+      if self.baseline_latency is None or median < self.baseline_latency:
+        self.baseline_latency = median
+      tail = float(np.percentile(latencies, self.latency_percentile))
+      slow = tail > self.latency_tolerance * self.baseline_latency
+
+    if self.adaptive:
+      if error_rate > self.max_error_rate or slow:
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+      else:
+        self.limit = min(self.max_limit, self.limit + self.increase)
+
+    self._latencies = []
+    self._window_errors = 0
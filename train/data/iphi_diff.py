@@ -0,0 +1,145 @@
+# Copyright 2021 Thea Sommerschield, Jonathan Prag,
+# Marita Chatzipanagiotou, John Pavlopoulos, Ion Androutsopoulos,
+# University of Oxford, DeepMind Technologies Limited, Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''Differences between two I.PHI builds.
+
+Every build can store a sidecar with a 64-bit hash of the text, dates and
+region of each record, sorted by id. Two builds are compared by a streaming
+merge of their sidecars (or of hashes computed from the datasets) into a
+JSON lines change list:
+
+  python -m train.data.iphi_diff --old=old/iphi-hashes.npy \\
+      --new=train/data/iphi-hashes.npy --output=train/data/iphi-changes.jsonl
+'''
+
+import argparse
+from collections import Counter
+import hashlib
+
+import numpy as np
+
+from train.data.iphi_io import DatasetWriter
+from train.data.iphi_record import read_phi_records
+
+
+p = argparse.ArgumentParser(prog='I.PHI diff',
+                            description='I.PHI build differences.')
+p.add_argument('--old', required=True, type=str,
+               help='old hash sidecar (.npy) or dataset')
+p.add_argument('--new', required=True, type=str,
+               help='new hash sidecar (.npy) or dataset')
+p.add_argument('--output', default='train/data/iphi-changes.jsonl', type=str,
+               help='output json lines change list')
+
+HASH_FIELDS = ('text', 'date', 'region')
+HASH_DTYPE = np.dtype([('id', np.int32)] +
+                      [(field, np.uint64) for field in HASH_FIELDS])
+
+
+def _hash(s):
+  return int.from_bytes(
+      hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def record_hashes(records):
+  '''Returns the field hashes of the records sorted by id.
+
+  If an id appears more than once the last record is kept.
+  '''
+  hashes = [(r.id,
+             _hash(r.text),
+             _hash('{}|{}|{}'.format(r.date_min, r.date_max, r.date_circa)),
+             _hash('{}|{}'.format(r.region_main_id, r.region_sub_id)))
+            for r in records]
+  hashes = np.array(hashes, dtype=HASH_DTYPE)
+
+  # Stable sort, then keep the last of each run of equal ids
+  hashes = hashes[np.argsort(hashes['id'], kind='stable')]
+  last = np.append(hashes['id'][1:] != hashes['id'][:-1], True)[:len(hashes)]
+  return hashes[last]
+
+
+def save_hashes(path, hashes):
+  np.save(path, hashes)
+
+
+def load_hashes(path):
+  '''Memory maps a sidecar, or hashes a dataset file.'''
+  if path.endswith('.npy'):
+    return np.load(path, mmap_mode='r')
+  return record_hashes(read_phi_records(path))
+
+
+def _diff_chunk(old, new):
+  '''Changes between two id-sorted chunks covering the same id range.'''
+  _, old_idx, new_idx = np.intersect1d(
+      old['id'], new['id'], assume_unique=True, return_indices=True)
+  removed = np.ones(len(old), bool)
+  removed[old_idx] = False
+  added = np.ones(len(new), bool)
+  added[new_idx] = False
+
+  changes = [(i, 'removed', None) for i in old['id'][removed].tolist()]
+  changes += [(i, 'added', None) for i in new['id'][added].tolist()]
+
+  changed = np.stack([old[field][old_idx] != new[field][new_idx]
+                      for field in HASH_FIELDS], axis=1)
+  rows = np.flatnonzero(changed.any(axis=1))
+  for i, row in zip(old['id'][old_idx[rows]].tolist(), changed[rows]):
+    changes.append((i, 'changed',
+                    [f for f, c in zip(HASH_FIELDS, row.tolist()) if c]))
+  changes.sort(key=lambda c: c[0])
+
+  for i, change, fields in changes:
+    output = {'id': i, 'change': change}
+    if fields:
+      output['fields'] = fields
+    yield output
+
+
+def diff_hashes(old, new, chunk_size=1 << 16):
+  '''Yields the changes from `old` to `new` in id order.
+
+  Both inputs are id-sorted hash arrays. They are merged chunk by chunk: each
+  step takes the ids up to the smaller of the two chunks' last ids, so at
+  most two chunks are in memory.
+  '''
+  i, j = 0, 0
+  while i < len(old) or j < len(new):
+    a = np.asarray(old[i:i + chunk_size])
+    b = np.asarray(new[j:j + chunk_size])
+    if len(a) and len(b):
+      bound = min(a['id'][-1], b['id'][-1])
+      a = a[:np.searchsorted(a['id'], bound, side='right')]
+      b = b[:np.searchsorted(b['id'], bound, side='right')]
+    i += len(a)
+    j += len(b)
+    yield from _diff_chunk(a, b)
+
+
+def main():
+  flags = p.parse_args()
+  cnt = Counter()
+  with DatasetWriter(flags.output) as writer:
+    for change in diff_hashes(load_hashes(flags.old), load_hashes(flags.new)):
+      writer.write(change)
+      cnt[change['change']] += 1
+
+  for change in ('added', 'removed', 'changed'):
+    print('{}:'.format(change.capitalize()), cnt[change])
+
+
+if __name__ == '__main__':
+  main()
@@ -18,26 +18,41 @@ import argparse
 from collections import Counter
 import concurrent.futures
 import glob
-import json
 import os
 import random
 import re
+
 import requests
 
-from bs4 import BeautifulSoup
 import cloudscraper
 from tqdm import tqdm
 
 from ithaca.util.alphabet import GreekAlphabet
-from train.data.iphi_dates import date_parser_phi
-from train.data.iphi_text_clean import strip_accents
-from train.data.iphi_text_clean import text_clean_phi
-from train.data.iphi_text_clean import text_to_sentences
+from train.data.iphi_concurrency import ConcurrencyController
+from train.data.iphi_diff import record_hashes
+from train.data.iphi_diff import save_hashes
+from train.data.iphi_io import write_dataset
+from train.data.iphi_io import write_lines
+from train.data.iphi_labels import build_label_tables
+from train.data.iphi_labels import save_label_tables
+from train.data.iphi_lacuna import build_lacuna_index
+from train.data.iphi_lacuna import save_lacuna_index
+from train.data.iphi_page import fetch_phi_page
+from train.data.iphi_page import INVALID_PAGE
+from train.data.iphi_page import parse_phi_page
+from train.data.iphi_page import PHI_URL
 
 
 p = argparse.ArgumentParser(prog='I.PHI', description='I.PHI JSON downloader.')
 p.add_argument('--connections', default=1, type=int, metavar='N',
                help='number of connections')
+p.add_argument('--min_connections', default=1, type=int, metavar='N',
+               help='minimum number of adaptive connections')
+p.add_argument('--max_connections', default=0, type=int, metavar='N',
+               help='maximum number of adaptive connections '
+                    '(0 keeps --connections fixed)')
+p.add_argument('--max_rps', default=0, type=float, metavar='N',
+               help='maximum requests per second (0 for unlimited)')
 p.add_argument('--timeout', default=5, type=int, metavar='N',
                help='seconds to timeout')
 p.add_argument('--output_dir',
@@ -45,7 +60,8 @@ p.add_argument('--output_dir',
                help='output path')
 p.add_argument('--output_json',
                default='train/data/iphi.json', type=str,
-               help='output json dataset')
+               help='output json dataset (.json or .jsonl, '
+                    'optionally .gz or .zst)')
 p.add_argument('--output_word_list',
                default='train/data/iphi-wordlist.txt',
                type=str, help='output wordlist')
@@ -55,6 +71,13 @@ p.add_argument('--output_region_main_list',
 p.add_argument('--output_region_sub_list',
                default='train/data/iphi-region-sub.txt',
                type=str, help='output region sub list')
+p.add_argument('--output_hashes', default='', type=str,
+               help='output npy per-record field hashes for iphi_diff '
+                    '(optional)')
+p.add_argument('--output_labels', default='', type=str,
+               help='output json region and date label tables (optional)')
+p.add_argument('--output_lacuna_index', default='', type=str,
+               help='output npz lacuna index (optional)')
 p.add_argument('--min_text_len', default=10, type=int, metavar='N',
                help='maximum text length')
 p.add_argument('--max_phi_id', default=400000, type=int, metavar='N',
@@ -63,11 +86,14 @@ p.add_argument('--max_retries_per_inscription', default=10,
                type=int, metavar='N', help='maximum retries per inscription')
 p.add_argument('--limit_phi_id', default=0, type=int, metavar='N',
                help='get a limited sample')
+p.add_argument('--phi_url', default=PHI_URL,
+               type=str, help='inscription url template')
 p.add_argument('--local', action='store_true', default=False)
 FLAGS = p.parse_args()
 
 
-def load_phi_id(phi_id, timeout, output, client, headers, alphabet):
+def load_phi_id(phi_id, timeout, output, client, headers, alphabet,
+                controller):
   '''Fetches the given PHI id.'''
   file_path = os.path.join(output, '{}.html'.format(phi_id))
 
@@ -77,96 +103,23 @@ def load_phi_id(phi_id, timeout, output, client, headers, alphabet):
     with open(file_path, 'r') as f:
       req_text = f.read().strip()
   else:
-    req_text = None
-    retries = 0
-    while retries <= FLAGS.max_retries_per_inscription and (
-            req_text is None or '520: Web server is returning an unknown error' in req_text):
-
-      req = client.get(
-          'https://epigraphy.packhum.org/text/{}'.format(phi_id),
-          timeout=timeout, headers=headers)
-      req_text = req.text
+    req_text = fetch_phi_page(
+        phi_id, client, headers, timeout,
+        max_retries=FLAGS.max_retries_per_inscription, controller=controller,
+        url=FLAGS.phi_url)
+    if req_text is None:
+      return
 
-  if 'Invalid PHI Inscription Number' not in req_text:
+  if INVALID_PAGE not in req_text:
     try:
-      soup = BeautifulSoup(req_text, 'lxml')
-
-      # Grab the text
-      lines = []
-      table = soup.find('table', attrs={'class': 'grk'})
-      for row in table.find_all('tr'):
-        tds = row.find_all('td')
-        for td_i, td in enumerate(tds):
-          if 'class' in td.attrs and td.attrs['class'][0] == 'id':
-            continue
-          lines.append(td.get_text().strip())
-      text = '\n'.join(lines)
-
-      # Clean text
-      text = text_clean_phi(text, alphabet)
-      sentences = text_to_sentences(text, alphabet)
-      text = ' '.join([s + '.' for s in sentences])
-
-      # Strip accents
-      text = strip_accents(text)
-
-      # Grab main and sub region
-      region_main, region_sub = '', ''
-      region_main_id, region_sub_id = -1, -1
-      hdr1 = soup.find('div', attrs={'class': 'hdr1'})
-      if hdr1:
-        hdr1_a = hdr1.find_all('a')
-        if hdr1_a and len(hdr1_a) == 3:
-          region_main_id = hdr1_a[1]['href'].replace('/regions/', '')
-          region_main = hdr1_a[1].get_text()
-          region_sub_id = hdr1_a[2]['href'].replace('/regions/', '')
-          region_sub = hdr1_a[2].get_text()
-        elif hdr1_a and len(hdr1_a) == 2:
-          region_main_id = hdr1_a[1]['href'].replace('/regions/', '')
-          region_main = hdr1_a[1].get_text()
-
-      # Grab the metadata
-      metadata = soup.find('span', attrs={'class': 'ti'})
-      if metadata:
-        metadata = metadata.get_text()
-      else:
-        metadata = ''
-
-      # Time
-      date_str = ''
-      date_min = None
-      date_max = None
-      date_circa = None
-      for tok in metadata.split('—'):
-        if re.search(
-                r'\W(BC|AD|period|reign|a\.|p\.(?!\s+\d)|aet\.)(\W|$)', tok):
-          date_str = tok
-          date_range, circa = date_parser_phi(tok)
-          if date_range:
-            date_min, date_max = date_range.split(' ')
-            date_circa = circa
-
-      # Output dictionary
-      output = {
-          'id': phi_id,
-          'text': text,
-          'metadata': metadata,
-          'region_main_id': region_main_id,
-          'region_main': region_main,
-          'region_sub_id': region_sub_id,
-          'region_sub': region_sub,
-          'date_str': date_str,
-          'date_min': date_min,
-          'date_max': date_max,
-          'date_circa': date_circa,
-      }
+      output = parse_phi_page(req_text, phi_id, alphabet)
 
       # Write intermediate output file
       if not path_exists:
         with open(file_path, 'w') as f:
           f.write(req_text)
 
-      if len(output['text'].replace(alphabet.missing, '')) >= FLAGS.min_text_len:
+      if len(output.text.replace(alphabet.missing, '')) >= FLAGS.min_text_len:
         return output
       return
     except:
@@ -175,11 +128,8 @@ def load_phi_id(phi_id, timeout, output, client, headers, alphabet):
 
 
 def counter_to_file(cnt, filepath):
-  with open(filepath, 'w') as f:
-    output = '\n'.join(
-        ['{};{}'.format(c, c_count) for c, c_count in
-         cnt.most_common()])
-    f.write(output)
+  write_lines(filepath, ('{};{}'.format(c, c_count) for c, c_count in
+                         cnt.most_common()))
 
 
 def main():
@@ -207,27 +157,38 @@ def main():
     else:
       range_ids = list(range(1, FLAGS.max_phi_id))
 
+  # Concurrency controller, adaptive if --max_connections is given
+  controller = ConcurrencyController(
+      initial=FLAGS.connections,
+      min_limit=FLAGS.min_connections,
+      max_limit=max(FLAGS.max_connections, FLAGS.connections),
+      max_rps=FLAGS.max_rps)
+
   # Download inscriptions
-  if FLAGS.connections == 1:
+  if controller.max_limit == 1:
     client = requests
     headers = {
         'User-Agent': 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
     }
     for text_i in tqdm(range_ids):
       result = load_phi_id(text_i, FLAGS.timeout, FLAGS.output_dir, client,
-                           headers, alphabet)
+                           headers, alphabet, controller)
       if result:
         dataset.append(result)
   else:
     client = cloudscraper.create_scraper()
     headers = {}
     with concurrent.futures.ThreadPoolExecutor(
-            max_workers=FLAGS.connections) as executor:
+            max_workers=controller.max_limit) as executor:
       future_to_phi = (
           executor.submit(load_phi_id, text_i, FLAGS.timeout, FLAGS.output_dir,
-                          client, headers, alphabet) for text_i in range_ids)
-      for future in tqdm(concurrent.futures.as_completed(future_to_phi),
-                         total=len(range_ids)):
+                          client, headers, alphabet, controller)
+          for text_i in range_ids)
+      pbar = tqdm(concurrent.futures.as_completed(future_to_phi),
+                  total=len(range_ids))
+      for future in pbar:
+        pbar.set_postfix(connections=controller.concurrency,
+                         errors=controller.errors, refresh=False)
         try:
           output = future.result()
           if output:
@@ -236,23 +197,35 @@ def main():
           pass
 
   # Write the dataset as a JSON file.
-  with open(FLAGS.output_json, 'w') as f:
-    json.dump(dataset, f)
+  write_dataset(FLAGS.output_json, dataset)
 
   print('Dataset size:', len(dataset))
 
+  # Field hashes to diff against later builds.
+  if FLAGS.output_hashes:
+    save_hashes(FLAGS.output_hashes, record_hashes(dataset))
+
+  # Region and date label tables for the training targets.
+  if FLAGS.output_labels:
+    save_label_tables(FLAGS.output_labels, build_label_tables(dataset))
+
+  # Index the lacunae and guess spans for restoration sampling.
+  if FLAGS.output_lacuna_index:
+    save_lacuna_index(FLAGS.output_lacuna_index,
+                      build_lacuna_index(dataset, alphabet))
+
   # Generate word list and region list.
   cnt_word = Counter()
   cnt_region_main = Counter()
   cnt_region_sub = Counter()
   for d in dataset:
-    for word in re.findall(r'\w+', d['text']):
+    for word in re.findall(r'\w+', d.text):
       cnt_word[word] += 1
 
-    region_main_k = '{}_{}'.format(d['region_main'], d['region_main_id'])
+    region_main_k = '{}_{}'.format(d.region_main, d.region_main_id)
     cnt_region_main[region_main_k] += 1
 
-    region_sub_k = '{}_{}'.format(d['region_sub'], d['region_sub_id'])
+    region_sub_k = '{}_{}'.format(d.region_sub, d.region_sub_id)
     cnt_region_sub[region_sub_k] += 1
 
   # Write counters.
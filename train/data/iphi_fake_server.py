@@ -0,0 +1,104 @@
+# Copyright 2021 Thea Sommerschield, Jonathan Prag,
+# Marita Chatzipanagiotou, John Pavlopoulos, Ion Androutsopoulos,
+# University of Oxford, DeepMind Technologies Limited, Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''Local stand-in for the PHI server that degrades under load.
+
+Serves synthetic inscriptions at /text/<id>. Once more than --capacity
+requests are in flight, responses slow down and a growing share of them
+fail with the 520 page, which lets the downloader's concurrency controller
+be exercised without touching the real server:
+
+  python -m train.data.iphi_fake_server --port=8000 --capacity=8
+  python -m train.data.iphi_download --phi_url=http://localhost:8000/text/{} \\
+      --connections=4 --max_connections=64 --limit_phi_id=2000
+'''
+
+import argparse
+import http.server
+import random
+import threading
+import time
+
+
+p = argparse.ArgumentParser(prog='I.PHI fake server',
+                            description='Local PHI stand-in server.')
+p.add_argument('--port', default=8000, type=int, metavar='N',
+               help='port to listen on')
+p.add_argument('--capacity', default=8, type=int, metavar='N',
+               help='concurrent requests served without degradation')
+p.add_argument('--latency', default=0.05, type=float, metavar='S',
+               help='base latency in seconds')
+
+PAGE = '''<html><body>
+<div class="hdr1"><a href="/regions/">Regions</a>
+<a href="/regions/{main_id}">Attica (IG I-III)</a>
+<a href="/regions/{sub_id}">Attica</a></div>
+<span class="ti">Att. — Ath.: Akr. — stoich. 22 — 4th c. BC</span>
+<table class="grk">
+<tr><td class="id">1</td><td>[ἔδοξεν τῆι βουλῆι καὶ τῶι δήμωι — — —]</td></tr>
+<tr><td class="id">2</td><td>τὸ ψήφισμα τόδε ἀναγράψαι ἐν στήληι λιθίνηι</td></tr>
+<tr><td class="id">3</td><td>καὶ στῆσαι ἐν ἀκροπόλει inscription {phi_id}</td></tr>
+</table></body></html>'''
+
+ERROR_PAGE = '520: Web server is returning an unknown error'
+
+
+class FakePhiHandler(http.server.BaseHTTPRequestHandler):
+  '''Serves synthetic PHI pages with load-dependent errors.'''
+
+  lock = threading.Lock()
+  in_flight = 0
+
+  def do_GET(self):
+    with self.lock:
+      FakePhiHandler.in_flight += 1
+      load = FakePhiHandler.in_flight / self.server.capacity
+    try:
+      # Latency grows linearly once over capacity
+      time.sleep(self.server.latency * max(1., load))
+      if load > 1 and random.random() < 1 - 1 / load:
+        self.reply(520, ERROR_PAGE)
+        return
+      phi_id = self.path.rstrip('/').split('/')[-1]
+      self.reply(200, PAGE.format(phi_id=phi_id, main_id=1701,
+                                  sub_id=1702 + int(phi_id or 0) % 3))
+    finally:
+      with self.lock:
+        FakePhiHandler.in_flight -= 1
+
+  def reply(self, status, body):
+    body = body.encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'text/html; charset=utf-8')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+def main():
+  flags = p.parse_args()
+  server = http.server.ThreadingHTTPServer(('localhost', flags.port),
+                                           FakePhiHandler)
+  server.capacity = flags.capacity
+  server.latency = flags.latency
+  print('Serving on port', flags.port)
+  server.serve_forever()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,319 @@
+# Copyright 2021 Thea Sommerschield, Jonathan Prag,
+# Marita Chatzipanagiotou, John Pavlopoulos, Ion Androutsopoulos,
+# University of Oxford, DeepMind Technologies Limited, Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''Reading and writing of the I.PHI outputs.
+
+The compression is selected by the file extension: `.gz` for gzip, `.zst`
+for zstd (requires the `zstandard` package) and plain text otherwise. The
+dataset format is JSON (`.json`) or JSON lines (`.jsonl`).
+
+Compressed files are written as a sequence of independently compressed
+blocks (gzip members / zstd frames), so that blocks are compressed in
+parallel and the result is still a valid file for the standard tools. A
+`<path>.idx` sidecar lists the offset, compressed length, uncompressed size
+and number of records of every block, so readers can seek to a block;
+`read_block_records` decodes the records of a single dataset block.
+'''
+
+import collections
+import concurrent.futures
+import gzip
+import io
+import json
+import os
+import zlib
+
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+
+
+def _zstd():
+  try:
+    import zstandard
+  except ImportError:
+    raise ImportError('zstd outputs require the zstandard package: '
+                      'pip install zstandard')
+  return zstandard
+
+
+def split_ext(path):
+  '''Returns the (format extension, compression) of a path.'''
+  root, ext = os.path.splitext(path)
+  compression = COMPRESSION_EXTENSIONS.get(ext)
+  if compression:
+    ext = os.path.splitext(root)[1]
+  return ext, compression
+
+
+def compress(data, compression, level=None):
+  '''Compresses a block of bytes into a self-contained gzip member/zstd frame.'''
+  if compression == 'gzip':
+    return gzip.compress(data, compresslevel=6 if level is None else level,
+                         mtime=0)
+  elif compression == 'zstd':
+    zstandard = _zstd()
+    return zstandard.ZstdCompressor(
+        level=3 if level is None else level).compress(data)
+  return data
+
+
+def decompress(data, compression):
+  '''Decompresses a single block.'''
+  if compression == 'gzip':
+    return zlib.decompress(data, wbits=16 + zlib.MAX_WBITS)
+  elif compression == 'zstd':
+    return _zstd().ZstdDecompressor().decompress(data)
+  return data
+
+
+class BlockWriter:
+  '''Writes text as independently compressed blocks.
+
+  Text passed to `write` is never split across blocks. Blocks are compressed
+  by a thread pool and written in order.
+  '''
+
+  def __init__(self, path, block_size=1 << 22, workers=None, level=None):
+    self.path = path
+    self.compression = split_ext(path)[1]
+    self.block_size = block_size
+    self.level = level
+    self.index = []
+    self._f = open(path, 'wb')
+    self._offset = 0
+    self._buffer = []
+    self._buffer_size = 0
+    self._buffer_records = 0
+    self._pending = collections.deque()
+    self._workers = workers or os.cpu_count() or 1
+    self._executor = None
+    if self.compression:
+      self._executor = concurrent.futures.ThreadPoolExecutor(
+          max_workers=self._workers)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def write(self, text, records=0):
+    '''Buffers text, flushing a block once it is large enough.'''
+    self._buffer.append(text)
+    self._buffer_size += len(text)
+    self._buffer_records += records
+    if self._buffer_size >= self.block_size:
+      self._flush_block()
+
+  def _flush_block(self):
+    if not self._buffer:
+      return
+    data = ''.join(self._buffer).encode('utf-8')
+    records = self._buffer_records
+    self._buffer, self._buffer_size, self._buffer_records = [], 0, 0
+
+    if not self.compression:
+      self._f.write(data)
+      return
+
+    future = self._executor.submit(compress, data, self.compression,
+                                   self.level)
+    self._pending.append((future, len(data), records))
+
+    # Bound the number of blocks held in memory
+    while len(self._pending) > 2 * self._workers:
+      self._write_pending()
+
+  def _write_pending(self):
+    future, size, records = self._pending.popleft()
+    block = future.result()
+    self._f.write(block)
+    self.index.append([self._offset, len(block), size, records])
+    self._offset += len(block)
+
+  def close(self):
+    self._flush_block()
+    while self._pending:
+      self._write_pending()
+    self._f.close()
+    if self._executor:
+      self._executor.shutdown()
+      with open(self.path + '.idx', 'w') as f:
+        json.dump({'compression': self.compression, 'blocks': self.index}, f)
+
+
+class DatasetWriter:
+  '''Streams records to a JSON or JSON lines dataset file.
+
+  The JSON output matches `json.dump(records, f)` byte for byte.
+  '''
+
+  def __init__(self, path, **kwargs):
+    self.jsonl = split_ext(path)[0] == '.jsonl'
+    self.count = 0
+    self._writer = BlockWriter(path, **kwargs)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def write(self, record):
+    if hasattr(record, 'to_dict'):
+      record = record.to_dict()
+    record = json.dumps(record)
+    if self.jsonl:
+      self._writer.write(record + '\n', records=1)
+    else:
+      self._writer.write(('[' if not self.count else ', ') + record,
+                         records=1)
+    self.count += 1
+
+  def close(self):
+    if not self.jsonl:
+      self._writer.write(']' if self.count else '[]')
+    self._writer.close()
+
+
+def write_dataset(path, records, **kwargs):
+  '''Writes an iterable of records; returns the number written.'''
+  with DatasetWriter(path, **kwargs) as writer:
+    for record in records:
+      writer.write(record)
+  return writer.count
+
+
+def write_lines(path, lines, **kwargs):
+  '''Writes lines joined by newlines, without a trailing newline.'''
+  with BlockWriter(path, **kwargs) as writer:
+    for i, line in enumerate(lines):
+      writer.write(('\n' if i else '') + line, records=1)
+
+
+def open_text(path):
+  '''Opens a possibly compressed file for reading as text.'''
+  compression = split_ext(path)[1]
+  if compression == 'gzip':
+    # Multiple gzip members are read as one stream
+    return gzip.open(path, 'rt', encoding='utf-8')
+  elif compression == 'zstd':
+    reader = _zstd().ZstdDecompressor().stream_reader(
+        open(path, 'rb'), read_across_frames=True)
+    return io.TextIOWrapper(reader, encoding='utf-8')
+  return open(path, 'r', encoding='utf-8')
+
+
+def read_index(path):
+  '''Returns the block index of a compressed file, or None.'''
+  if not os.path.exists(path + '.idx'):
+    return None
+  with open(path + '.idx', 'r') as f:
+    return json.load(f)['blocks']
+
+
+def _require_index(path):
+  index = read_index(path)
+  if index is None:
+    raise ValueError('No block index {}.idx; only compressed outputs are '
+                     'written in blocks.'.format(path))
+  return index
+
+
+def read_block(path, i, index=None):
+  '''Reads and decompresses the i-th block of a compressed file.'''
+  if index is None:
+    index = _require_index(path)
+  offset, length = index[i][:2]
+  with open(path, 'rb') as f:
+    f.seek(offset)
+    data = f.read(length)
+  return decompress(data, split_ext(path)[1]).decode('utf-8')
+
+
+def iter_blocks(path):
+  '''Yields the decompressed blocks of a compressed file in order.'''
+  index = _require_index(path)
+  compression = split_ext(path)[1]
+  with open(path, 'rb') as f:
+    for offset, length, _, _ in index:
+      f.seek(offset)
+      yield decompress(f.read(length), compression).decode('utf-8')
+
+
+def read_block_records(path, i, index=None):
+  '''Reads the records of the i-th block of a compressed dataset.
+
+  A JSON block is a slice of the top-level array, so its leading `[` or
+  `, ` and, in the last block, the closing `]` are removed before decoding.
+  '''
+  if index is None:
+    index = _require_index(path)
+  text = read_block(path, i, index)
+  ext = split_ext(path)[0]
+  if ext == '.jsonl':
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+  elif ext != '.json':
+    raise ValueError('{} is not a JSON or JSON lines dataset.'.format(path))
+
+  if range(len(index))[i] == len(index) - 1:
+    text = text[:text.rindex(']')]
+  if text.startswith('['):
+    text = text[1:]
+  elif text.startswith(', '):
+    text = text[2:]
+  return json.loads('[' + text + ']')
+
+
+def _iter_json_array(f, chunk_size=1 << 20):
+  '''Incrementally decodes the elements of a top-level JSON array.'''
+  decoder = json.JSONDecoder()
+  buf, pos, eof = '', 0, False
+  started = False
+  while True:
+    # Skip separators
+    while pos < len(buf) and buf[pos] in ' \t\r\n,[]':
+      if buf[pos] == '[':
+        started = True
+      elif buf[pos] == ']' and started:
+        return
+      pos += 1
+
+    if pos < len(buf):
+      try:
+        obj, end = decoder.raw_decode(buf, pos)
+      except json.JSONDecodeError:
+        if eof:
+          raise
+      else:
+        yield obj
+        pos = end
+        continue
+    elif eof:
+      return
+
+    chunk = f.read(chunk_size)
+    eof = not chunk
+    buf, pos = buf[pos:] + chunk, 0
+
+
+def read_records(path):
+  '''Streams the records of a (possibly compressed) JSON/JSONL dataset.'''
+  with open_text(path) as f:
+    if split_ext(path)[0] == '.jsonl':
+      for line in f:
+        if line.strip():
+          yield json.loads(line)
+    else:
+      yield from _iter_json_array(f)
@@ -0,0 +1,190 @@
+# Copyright 2021 Thea Sommerschield, Jonathan Prag,
+# Marita Chatzipanagiotou, John Pavlopoulos, Ion Androutsopoulos,
+# University of Oxford, DeepMind Technologies Limited, Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''Region and date label tables for the I.PHI training targets.
+
+The tables map the PHI region ids to contiguous class indices, keep the
+main/sub region hierarchy and the covered date range:
+
+  python -m train.data.iphi_labels --dataset=train/data/iphi.json
+'''
+
+import argparse
+from collections import Counter
+import json
+
+import numpy as np
+
+from train.data.iphi_record import NO_DATE
+from train.data.iphi_record import NO_REGION
+from train.data.iphi_record import read_phi_records
+from train.data.iphi_record import region_id_to_int
+from train.data.iphi_record import records_to_array
+from train.data.iphi_stats import batches
+
+
+p = argparse.ArgumentParser(prog='I.PHI labels',
+                            description='I.PHI label tables.')
+p.add_argument('--dataset', default='train/data/iphi.json', type=str,
+               help='input dataset')
+p.add_argument('--output', default='train/data/iphi-labels.json', type=str,
+               help='output json label tables')
+p.add_argument('--output_targets', default='', type=str,
+               help='output npz of the encoded dataset targets (optional)')
+p.add_argument('--date_bin', default=10, type=int, metavar='N',
+               help='date bin size in years for --output_targets')
+p.add_argument('--batch_size', default=4096, type=int, metavar='N',
+               help='records per batch')
+
+
+def build_label_tables(records):
+  '''Builds the region and date label tables from an iterable of records.'''
+  main_names, sub_names, sub_main = {}, {}, {}
+  date_min, date_max = None, None
+  for r in records:
+    main_id = region_id_to_int(r.region_main_id)
+    sub_id = region_id_to_int(r.region_sub_id)
+    if main_id != NO_REGION:
+      main_names.setdefault(main_id, Counter())[r.region_main] += 1
+    if sub_id != NO_REGION:
+      sub_names.setdefault(sub_id, Counter())[r.region_sub] += 1
+      if main_id != NO_REGION:
+        sub_main.setdefault(sub_id, Counter())[main_id] += 1
+    if r.dated:
+      date_min = r.date_min if date_min is None else min(date_min, r.date_min)
+      date_max = r.date_max if date_max is None else max(date_max, r.date_max)
+
+  # Sorted ids give the class indices; a sub region belongs to the main
+  # region it is most often listed under
+  main_ids = sorted(main_names)
+  main_idx = {region_id: i for i, region_id in enumerate(main_ids)}
+  return {
+      'region_main': [
+          {'id': region_id, 'name': main_names[region_id].most_common(1)[0][0]}
+          for region_id in main_ids],
+      'region_sub': [
+          {'id': region_id, 'name': sub_names[region_id].most_common(1)[0][0],
+           'main': main_idx[sub_main[region_id].most_common(1)[0][0]]
+                   if region_id in sub_main else -1}
+          for region_id in sorted(sub_names)],
+      'date': {'min': date_min, 'max': date_max},
+  }
+
+
+def save_label_tables(path, tables):
+  with open(path, 'w') as f:
+    json.dump(tables, f, ensure_ascii=False, indent=2)
+
+
+def load_label_tables(path):
+  with open(path, 'r') as f:
+    return json.load(f)
+
+
+class LabelEncoder:
+  '''Encodes batches of records into region and date targets.
+
+  Regions become class indices (-1 if unknown). Dates become a probability
+  distribution over bins of `date_bin` years, uniform over the years from
+  `date_min` to `date_max`; undated records get an all-zero row.
+  '''
+
+  def __init__(self, tables, date_bin=10, date_min=None, date_max=None):
+    self.tables = tables
+    self.main_ids = np.array([r['id'] for r in tables['region_main']],
+                             dtype=np.int64)
+    self.sub_ids = np.array([r['id'] for r in tables['region_sub']],
+                            dtype=np.int64)
+    self.sub_to_main = np.array([r['main'] for r in tables['region_sub']],
+                                dtype=np.int32)
+
+    if date_min is None:
+      date_min = tables['date']['min'] or 0
+    if date_max is None:
+      date_max = tables['date']['max'] or 0
+    self.date_bin = date_bin
+    start = int(np.floor(date_min / date_bin)) * date_bin
+    stop = (int(np.floor(date_max / date_bin)) + 1) * date_bin
+    self.date_edges = np.arange(start, stop + 1, date_bin)
+
+  @property
+  def num_region_main(self):
+    return len(self.main_ids)
+
+  @property
+  def num_region_sub(self):
+    return len(self.sub_ids)
+
+  @property
+  def num_date_bins(self):
+    return len(self.date_edges) - 1
+
+  def _lookup(self, ids, table):
+    '''Maps region ids to their index in a sorted id table, else -1.'''
+    idx = np.searchsorted(table, ids)
+    idx = np.minimum(idx, max(len(table) - 1, 0))
+    found = (table[idx] == ids) if len(table) else np.zeros(len(ids), bool)
+    return np.where(found, idx, -1).astype(np.int32)
+
+  def encode_dates(self, date_min, date_max):
+    '''Date bin distributions of arrays of date ranges (NO_DATE if unknown).'''
+    dated = (date_min != NO_DATE) & (date_max != NO_DATE)
+    lo = np.where(dated, date_min, 0).astype(np.float64)[:, None]
+    hi = np.where(dated, date_max, -1).astype(np.float64)[:, None] + 1
+
+    # Overlap in years of [date_min, date_max + 1) with every bin
+    overlap = np.clip(np.minimum(hi, self.date_edges[None, 1:]) -
+                      np.maximum(lo, self.date_edges[None, :-1]), 0, None)
+    total = overlap.sum(axis=1, keepdims=True)
+    dist = np.divide(overlap, total, out=np.zeros_like(overlap),
+                     where=total > 0)
+    return dist.astype(np.float32), dated & (total[:, 0] > 0)
+
+  def encode(self, records):
+    '''Encodes a batch of records into target arrays.'''
+    columns = records_to_array(records)
+    region_main = self._lookup(columns['region_main_id'], self.main_ids)
+    region_sub = self._lookup(columns['region_sub_id'], self.sub_ids)
+    date_dist, dated = self.encode_dates(columns['date_min'],
+                                         columns['date_max'])
+    return {
+        'id': columns['id'],
+        'region_main': region_main,
+        'region_sub': region_sub,
+        'date_dist': date_dist,
+        'dated': dated,
+    }
+
+
+def main():
+  flags = p.parse_args()
+  tables = build_label_tables(read_phi_records(flags.dataset))
+  save_label_tables(flags.output, tables)
+  print('Region main size:', len(tables['region_main']))
+  print('Region sub size:', len(tables['region_sub']))
+
+  if flags.output_targets:
+    encoder = LabelEncoder(tables, date_bin=flags.date_bin)
+    targets = {}
+    for batch in batches(read_phi_records(flags.dataset), flags.batch_size):
+      for k, v in encoder.encode(batch).items():
+        targets.setdefault(k, []).append(v)
+    np.savez_compressed(flags.output_targets,
+                        date_edges=encoder.date_edges,
+                        **{k: np.concatenate(v) for k, v in targets.items()})
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,250 @@
+# Copyright 2021 Thea Sommerschield, Jonathan Prag,
+# Marita Chatzipanagiotou, John Pavlopoulos, Ion Androutsopoulos,
+# University of Oxford, DeepMind Technologies Limited, Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''Index of the lacunae and guess spans of the I.PHI texts.
+
+The texts are tokenized with `alphabet.char2idx` after removing the guess
+brackets. For every inscription the index stores the start and length of
+each run of `alphabet.missing` characters and of each `[...]` span, in
+positions of the tokenized text:
+
+  python -m train.data.iphi_lacuna --dataset=train/data/iphi.json
+'''
+
+import argparse
+
+import numpy as np
+
+from ithaca.util.alphabet import GreekAlphabet
+from train.data.iphi_record import read_phi_records
+from train.data.iphi_stats import batches
+from train.data.iphi_stats import encode_table
+from train.data.iphi_stats import encode_texts
+
+
+p = argparse.ArgumentParser(prog='I.PHI lacuna index',
+                            description='I.PHI lacuna index builder.')
+p.add_argument('--dataset', default='train/data/iphi.json', type=str,
+               help='input dataset')
+p.add_argument('--output', default='train/data/iphi-lacuna.npz', type=str,
+               help='output npz index')
+p.add_argument('--batch_size', default=4096, type=int, metavar='N',
+               help='records per batch')
+
+
+def _runs(mask):
+  '''Returns the (start, length) of the runs of True in a boolean array.'''
+  edges = np.diff(np.concatenate([[0], mask.view(np.int8), [0]]))
+  starts = np.flatnonzero(edges == 1)
+  return starts, np.flatnonzero(edges == -1) - starts
+
+
+def _guess_spans(sog, eog, positions, text_starts, text_ends):
+  '''Pairs bracket positions into spans.
+
+  `sog` and `eog` index the brackets in the encoded texts and `positions`
+  maps them to the text without brackets. Brackets are paired in their
+  original order, since `][` and `[]` map to the same positions. Unclosed
+  brackets extend to the end of their text and unopened ones to its start,
+  since PHI lines often begin or end inside a restoration.
+  '''
+  events = np.concatenate([sog, eog])
+  kinds = np.concatenate([np.ones(len(sog), np.int8),
+                          np.zeros(len(eog), np.int8)])
+  order = np.argsort(events)
+  events = positions[events[order]]
+  texts = np.searchsorted(text_starts, events, side='right') - 1
+
+  spans = []
+  open_pos, open_text = None, None
+  for pos, is_open, text in zip(events.tolist(), kinds[order].tolist(),
+                                texts.tolist()):
+    if open_pos is not None and text != open_text:
+      spans.append((open_pos, text_ends[open_text]))
+      open_pos = None
+    if is_open:
+      if open_pos is None:
+        open_pos, open_text = pos, text
+    elif open_pos is not None:
+      spans.append((open_pos, pos))
+      open_pos = None
+    else:
+      spans.append((text_starts[text], pos))
+  if open_pos is not None:
+    spans.append((open_pos, text_ends[open_text]))
+  return np.array(spans, dtype=np.int64).reshape(-1, 2)
+
+
+def build_lacuna_index(records, alphabet, batch_size=4096):
+  '''Builds the lacuna index of an iterable of records.'''
+  table = encode_table(alphabet)
+  sog_idx, eog_idx = alphabet.size_char(), alphabet.size_char() + 1
+  missing_idx = alphabet.char2idx[alphabet.missing]
+
+  ids, lengths, chars = [], [], []
+  missing = [[], [], []]
+  guess = [[], [], []]
+  n_records = 0
+  for batch in batches(records, batch_size):
+    idx = encode_texts([r.text for r in batch], table, alphabet.pad)
+
+    # Positions in the text without brackets
+    brackets = (idx == sog_idx) | (idx == eog_idx)
+    stripped_pos = np.cumsum(~brackets) - 1
+    stripped = idx[~brackets]
+
+    # Text boundaries, excluding the separator
+    ends = np.flatnonzero(stripped == alphabet.pad_idx)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+
+    # Runs of missing characters
+    run_starts, run_lengths = _runs(stripped == missing_idx)
+    run_texts = np.searchsorted(starts, run_starts, side='right') - 1
+    missing[0].append(run_texts + n_records)
+    missing[1].append(run_starts - starts[run_texts])
+    missing[2].append(run_lengths)
+
+    # Bracketed spans
+    spans = _guess_spans(np.flatnonzero(idx == sog_idx),
+                         np.flatnonzero(idx == eog_idx), stripped_pos + 1,
+                         starts, ends)
+    spans = spans[spans[:, 1] > spans[:, 0]]
+    span_texts = np.searchsorted(starts, spans[:, 0], side='right') - 1
+    guess[0].append(span_texts + n_records)
+    guess[1].append(spans[:, 0] - starts[span_texts])
+    guess[2].append(spans[:, 1] - spans[:, 0])
+
+    ids.append(np.array([r.id for r in batch], dtype=np.int32))
+    lengths.append(ends - starts)
+    chars.append(stripped[stripped != alphabet.pad_idx].astype(np.uint8))
+    n_records += len(batch)
+
+  def concat(arrays, dtype):
+    return np.concatenate(arrays).astype(dtype) if arrays else np.zeros(
+        0, dtype)
+
+  lengths = concat(lengths, np.int64)
+  index = {
+      'ids': concat(ids, np.int32),
+      'text_offsets': np.concatenate([[0], np.cumsum(lengths)]),
+      'chars': concat(chars, np.uint8),
+  }
+  for name, (record, start, length) in (('missing', missing),
+                                        ('guess', guess)):
+    record = concat(record, np.int32)
+    index[name + '_record'] = record
+    index[name + '_start'] = concat(start, np.int32)
+    index[name + '_length'] = concat(length, np.int32)
+    index[name + '_offsets'] = np.searchsorted(
+        record, np.arange(n_records + 1)).astype(np.int64)
+  return index
+
+
+def save_lacuna_index(path, index):
+  np.savez(path, **index)
+
+
+def load_lacuna_index(path):
+  with np.load(path) as f:
+    return dict(f)
+
+
+class LacunaSampler:
+  '''Samples text windows that contain or avoid damage.
+
+  Windows are returned as (record, start) arrays in positions of the
+  tokenized text, so only the index is touched. Each draw is O(1): damaged
+  windows pick a span uniformly and clean windows pick uniformly among the
+  undamaged segments long enough for the window (computed once per window
+  size).
+  '''
+
+  def __init__(self, index, seed=None):
+    self.index = index
+    self.rng = np.random.default_rng(seed)
+    self.text_offsets = index['text_offsets']
+    self.text_lengths = np.diff(self.text_offsets)
+    self._clean_segments()
+    self._eligible = {}
+
+  def _clean_segments(self):
+    '''Complement of the union of missing runs and guess spans per text.'''
+    offsets = self.text_offsets
+    starts, ends = [offsets[:-1], offsets[1:]], [offsets[:-1], offsets[1:]]
+    for name in ('missing', 'guess'):
+      s = offsets[self.index[name + '_record']] + self.index[name + '_start']
+      starts.append(s)
+      ends.append(s + self.index[name + '_length'])
+    starts, ends = np.concatenate(starts), np.concatenate(ends)
+
+    # Text boundaries act as empty blocked intervals; merge the rest
+    order = np.argsort(starts, kind='stable')
+    starts, ends = starts[order], np.maximum.accumulate(ends[order])
+    gap_starts, gap_ends = ends[:-1], starts[1:]
+    clean = gap_ends > gap_starts
+    self.clean_start = gap_starts[clean]
+    self.clean_length = (gap_ends - gap_starts)[clean]
+    self.clean_record = np.searchsorted(
+        offsets, self.clean_start, side='right') - 1
+
+  def damaged(self, window, size=None, kind='missing'):
+    '''Samples windows containing a whole span, or inside a longer one.'''
+    n = len(self.index[kind + '_record'])
+    if not n:
+      raise ValueError('No {} spans in the index.'.format(kind))
+    j = self.rng.integers(n, size=size)
+    record = self.index[kind + '_record'][j]
+    start = self.index[kind + '_start'][j].astype(np.int64)
+    end = start + self.index[kind + '_length'][j]
+    text_length = self.text_lengths[record]
+
+    lo = np.maximum(0, end - window)
+    hi = np.minimum(start, np.maximum(text_length - window, 0))
+    longer = lo > hi
+    lo = np.where(longer, start, lo)
+    hi = np.where(longer, end - window, hi)
+    return record, lo + self.rng.integers(hi - lo + 1)
+
+  def clean(self, window, size=None):
+    '''Samples windows free of missing characters and guess spans.'''
+    if window not in self._eligible:
+      self._eligible[window] = np.flatnonzero(self.clean_length >= window)
+    eligible = self._eligible[window]
+    if not len(eligible):
+      raise ValueError('No clean segments of length {}.'.format(window))
+    j = eligible[self.rng.integers(len(eligible), size=size)]
+    offset = self.rng.integers(self.clean_length[j] - window + 1)
+    record = self.clean_record[j]
+    return record, self.clean_start[j] - self.text_offsets[record] + offset
+
+  def tokens(self, record, start, window):
+    '''Returns the tokens of a window of one record.'''
+    offset = self.text_offsets[record]
+    end = min(start + window, self.text_lengths[record])
+    return self.index['chars'][offset + start:offset + end]
+
+
+def main():
+  flags = p.parse_args()
+  index = build_lacuna_index(read_phi_records(flags.dataset), GreekAlphabet(),
+                             flags.batch_size)
+  save_lacuna_index(flags.output, index)
+  print('Records:', len(index['ids']))
+  print('Missing runs:', len(index['missing_record']))
+  print('Guess spans:', len(index['guess_record']))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,142 @@
+# Copyright 2021 Thea Sommerschield, Jonathan Prag,
+# Marita Chatzipanagiotou, John Pavlopoulos, Ion Androutsopoulos,
+# University of Oxford, DeepMind Technologies Limited, Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''Fetching and parsing of single PHI inscription pages.'''
+
+import re
+import time
+
+from bs4 import BeautifulSoup
+
+from train.data.iphi_dates import date_parser_phi
+from train.data.iphi_record import PhiRecord
+from train.data.iphi_text_clean import strip_accents
+from train.data.iphi_text_clean import text_clean_phi
+from train.data.iphi_text_clean import text_to_sentences
+
+PHI_URL = 'https://epigraphy.packhum.org/text/{}'
+ERROR_PAGE = '520: Web server is returning an unknown error'
+INVALID_PAGE = 'Invalid PHI Inscription Number'
+
+
+def fetch_phi_page(phi_id, client, headers, timeout, max_retries=10,
+                   controller=None, url=PHI_URL):
+  '''Downloads the page of a PHI id, retrying on errors.
+
+  Returns None if every attempt failed. Attempts are reported to the
+  concurrency controller, if given, so it can back off.
+  '''
+  req_text = None
+  retries = 0
+  while retries <= max_retries and (req_text is None or ERROR_PAGE in req_text):
+    retries += 1
+
+    if controller is not None:
+      controller.acquire()
+    start = time.monotonic()
+    error = True
+    try:
+      req = client.get(url.format(phi_id), timeout=timeout, headers=headers)
+      req_text = req.text
+      error = req.status_code >= 500 or ERROR_PAGE in req_text
+    except Exception:
+      # cloudscraper raises its Cloudflare errors as plain exceptions
+      continue
+    finally:
+      # Always free the slot, or failed attempts would leak it
+      if controller is not None:
+        controller.release(time.monotonic() - start, error=error)
+  return req_text
+
+
+def parse_phi_page(req_text, phi_id, alphabet):
+  '''Converts the HTML of a PHI page to a record.
+
+  Returns None for invalid PHI ids and raises if the page cannot be parsed.
+  '''
+  if INVALID_PAGE in req_text:
+    return
+
+  soup = BeautifulSoup(req_text, 'lxml')
+
+  # Grab the text
+  lines = []
+  table = soup.find('table', attrs={'class': 'grk'})
+  for row in table.find_all('tr'):
+    tds = row.find_all('td')
+    for td_i, td in enumerate(tds):
+      if 'class' in td.attrs and td.attrs['class'][0] == 'id':
+        continue
+      lines.append(td.get_text().strip())
+  text = '\n'.join(lines)
+
+  # Clean text
+  text = text_clean_phi(text, alphabet)
+  sentences = text_to_sentences(text, alphabet)
+  text = ' '.join([s + '.' for s in sentences])
+
+  # Strip accents
+  text = strip_accents(text)
+
+  # Grab main and sub region
+  region_main, region_sub = '', ''
+  region_main_id, region_sub_id = -1, -1
+  hdr1 = soup.find('div', attrs={'class': 'hdr1'})
+  if hdr1:
+    hdr1_a = hdr1.find_all('a')
+    if hdr1_a and len(hdr1_a) == 3:
+      region_main_id = hdr1_a[1]['href'].replace('/regions/', '')
+      region_main = hdr1_a[1].get_text()
+      region_sub_id = hdr1_a[2]['href'].replace('/regions/', '')
+      region_sub = hdr1_a[2].get_text()
+    elif hdr1_a and len(hdr1_a) == 2:
+      region_main_id = hdr1_a[1]['href'].replace('/regions/', '')
+      region_main = hdr1_a[1].get_text()
+
+  # Grab the metadata
+  metadata = soup.find('span', attrs={'class': 'ti'})
+  if metadata:
+    metadata = metadata.get_text()
+  else:
+    metadata = ''
+
+  # Time
+  date_str = ''
+  date_min = None
+  date_max = None
+  date_circa = None
+  for tok in metadata.split('—'):
+    if re.search(
+            r'\W(BC|AD|period|reign|a\.|p\.(?!\s+\d)|aet\.)(\W|$)', tok):
+      date_str = tok
+      date_range, circa = date_parser_phi(tok)
+      if date_range:
+        date_min, date_max = date_range.split(' ')
+        date_circa = circa
+
+  # Output record
+  return PhiRecord(
+      id=phi_id,
+      text=text,
+      metadata=metadata,
+      region_main_id=region_main_id,
+      region_main=region_main,
+      region_sub_id=region_sub_id,
+      region_sub=region_sub,
+      date_str=date_str,
+      date_min=date_min,
+      date_max=date_max,
+      date_circa=date_circa,
+  )
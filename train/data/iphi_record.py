@@ -0,0 +1,137 @@
+# Copyright 2021 Thea Sommerschield, Jonathan Prag,
+# Marita Chatzipanagiotou, John Pavlopoulos, Ion Androutsopoulos,
+# University of Oxford, DeepMind Technologies Limited, Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import dataclasses
+import sys
+from typing import Optional, Union
+
+import numpy as np
+
+from train.data.iphi_io import read_records
+
+# Sentinels of the columnar representation
+NO_DATE = np.iinfo(np.int32).min
+NO_REGION = -1
+NO_CIRCA = -1
+
+RECORD_DTYPE = np.dtype([
+    ('id', np.int32),
+    ('region_main_id', np.int32),
+    ('region_sub_id', np.int32),
+    ('date_min', np.int32),
+    ('date_max', np.int32),
+    ('date_circa', np.int8),
+    ('text_len', np.int32),
+])
+
+
+def _intern(s):
+  return sys.intern(s) if isinstance(s, str) else s
+
+
+def region_id_to_int(region_id):
+  '''Converts a PHI region id to an integer, NO_REGION if missing.'''
+  try:
+    return int(region_id)
+  except (TypeError, ValueError):
+    return NO_REGION
+
+
+@dataclasses.dataclass
+class PhiRecord:
+  '''A processed PHI inscription.
+
+  Region ids, region names and date strings repeat across the corpus and are
+  interned; dates are kept as integers. `to_dict` gives back the JSON record.
+  '''
+  __slots__ = ('id', 'text', 'metadata', 'region_main_id', 'region_main',
+               'region_sub_id', 'region_sub', 'date_str', 'date_min',
+               'date_max', 'date_circa')
+
+  id: int
+  text: str
+  metadata: str
+  region_main_id: Union[str, int]
+  region_main: str
+  region_sub_id: Union[str, int]
+  region_sub: str
+  date_str: str
+  date_min: Optional[int]
+  date_max: Optional[int]
+  date_circa: Optional[bool]
+
+  def __post_init__(self):
+    self.region_main_id = _intern(self.region_main_id)
+    self.region_main = _intern(self.region_main)
+    self.region_sub_id = _intern(self.region_sub_id)
+    self.region_sub = _intern(self.region_sub)
+    self.date_str = _intern(self.date_str)
+    if self.date_min is not None:
+      self.date_min = int(self.date_min)
+    if self.date_max is not None:
+      self.date_max = int(self.date_max)
+
+  @property
+  def dated(self):
+    return self.date_min is not None and self.date_max is not None
+
+  def to_dict(self):
+    '''Returns the record in the I.PHI JSON format.'''
+    return {
+        'id': self.id,
+        'text': self.text,
+        'metadata': self.metadata,
+        'region_main_id': self.region_main_id,
+        'region_main': self.region_main,
+        'region_sub_id': self.region_sub_id,
+        'region_sub': self.region_sub,
+        'date_str': self.date_str,
+        'date_min': None if self.date_min is None else str(self.date_min),
+        'date_max': None if self.date_max is None else str(self.date_max),
+        'date_circa': self.date_circa,
+    }
+
+  @classmethod
+  def from_dict(cls, d):
+    return cls(**{k: d[k] for k in cls.__slots__})
+
+
+def read_phi_records(path):
+  '''Streams a dataset file as PhiRecords.'''
+  for d in read_records(path):
+    yield PhiRecord.from_dict(d)
+
+
+def records_to_array(records):
+  '''Converts a batch of records to a numpy structured array.
+
+  Missing regions are `NO_REGION`, missing dates `NO_DATE` and a missing
+  circa flag `NO_CIRCA`.
+  '''
+  array = np.empty(len(records), dtype=RECORD_DTYPE)
+  array['id'] = [r.id for r in records]
+  array['region_main_id'] = [region_id_to_int(r.region_main_id)
+                             for r in records]
+  array['region_sub_id'] = [region_id_to_int(r.region_sub_id)
+                            for r in records]
+  array['date_min'] = [NO_DATE if r.date_min is None else r.date_min
+                       for r in records]
+  array['date_max'] = [NO_DATE if r.date_max is None else r.date_max
+                       for r in records]
+  array['date_circa'] = [NO_CIRCA if r.date_circa is None else r.date_circa
+                         for r in records]
+  array['text_len'] = [len(r.text) for r in records]
+  return array
@@ -0,0 +1,142 @@
+# Copyright 2021 Thea Sommerschield, Jonathan Prag,
+# Marita Chatzipanagiotou, John Pavlopoulos, Ion Androutsopoulos,
+# University of Oxford, DeepMind Technologies Limited, Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''Deterministic train/valid/test split of the I.PHI dataset.
+
+Each record is assigned by a hash of its PHI id, so the assignment does not
+depend on the other records and is kept when the dataset is rebuilt. The
+records are streamed straight into one output file per split:
+
+  python -m train.data.iphi_split --dataset=train/data/iphi.json \\
+      --output=train/data/iphi-{split}.json
+'''
+
+import argparse
+from collections import Counter
+import hashlib
+import json
+import math
+
+from train.data.iphi_io import DatasetWriter
+from train.data.iphi_record import read_phi_records
+
+
+p = argparse.ArgumentParser(prog='I.PHI split',
+                            description='I.PHI dataset splitter.')
+p.add_argument('--dataset', default='train/data/iphi.json', type=str,
+               help='input dataset')
+p.add_argument('--output', default='train/data/iphi-{split}.json', type=str,
+               help='output path pattern, {split} is the split name')
+p.add_argument('--splits', default='train=0.8,valid=0.1,test=0.1', type=str,
+               help='comma separated split=fraction pairs')
+p.add_argument('--seed', default='iphi', type=str,
+               help='hash salt; changing it reshuffles every record')
+p.add_argument('--date_bucket', default=100, type=int, metavar='N',
+               help='date bucket size in years for the summary strata')
+p.add_argument('--output_summary', default='', type=str,
+               help='output json with the counts per split and stratum')
+
+
+def parse_splits(splits):
+  '''Parses `train=0.8,valid=0.1,test=0.1` into normalised pairs.'''
+  pairs = []
+  for split in splits.split(','):
+    name, fraction = split.split('=')
+    pairs.append((name.strip(), float(fraction)))
+  total = sum(f for _, f in pairs)
+  if total <= 0:
+    raise ValueError('Split fractions must sum to a positive number.')
+  return [(name, f / total) for name, f in pairs]
+
+
+def hash_fraction(key, seed=''):
+  '''Maps a key to a stable pseudo-random number in [0, 1).'''
+  digest = hashlib.blake2b('{}/{}'.format(seed, key).encode('utf-8'),
+                           digest_size=8).digest()
+  return int.from_bytes(digest, 'big') / 2**64
+
+
+def date_bucket(record, size=100):
+  '''Bucket of the date midpoint, or 'undated'.'''
+  if not record.dated:
+    return 'undated'
+  midpoint = (record.date_min + record.date_max) / 2
+  return str(math.floor(midpoint / size) * size)
+
+
+def stratum(record, date_bucket_size=100):
+  return '{}/{}'.format(record.region_main_id,
+                        date_bucket(record, date_bucket_size))
+
+
+class SplitAssigner:
+  '''Assigns records to splits by a stable hash of their PHI id.
+
+  The hash only depends on the id, so every main region and date bucket is
+  split in the given proportions in expectation, and a record keeps its
+  split when its metadata is corrected.
+  '''
+
+  def __init__(self, splits, seed='iphi'):
+    self.names = [name for name, _ in splits]
+    self.thresholds = []
+    total = 0.
+    for _, fraction in splits:
+      total += fraction
+      self.thresholds.append(total)
+    self.thresholds[-1] = 1.
+    self.seed = seed
+
+  def __call__(self, record):
+    x = hash_fraction(record.id, self.seed)
+    for name, threshold in zip(self.names, self.thresholds):
+      if x < threshold:
+        return name
+    return self.names[-1]
+
+
+def split_dataset(records, output, assigner, date_bucket_size=100):
+  '''Streams records into one writer per split; returns the counts.'''
+  writers = {name: DatasetWriter(output.format(split=name))
+             for name in assigner.names}
+  counts = {name: Counter() for name in assigner.names}
+  try:
+    for record in records:
+      name = assigner(record)
+      writers[name].write(record)
+      counts[name][stratum(record, date_bucket_size)] += 1
+  finally:
+    for writer in writers.values():
+      writer.close()
+  return counts
+
+
+def main():
+  flags = p.parse_args()
+  assigner = SplitAssigner(parse_splits(flags.splits), seed=flags.seed)
+  counts = split_dataset(read_phi_records(flags.dataset), flags.output,
+                         assigner, flags.date_bucket)
+
+  for name, cnt in counts.items():
+    print('{} size:'.format(name), sum(cnt.values()))
+
+  if flags.output_summary:
+    with open(flags.output_summary, 'w') as f:
+      json.dump({name: dict(cnt.most_common())
+                 for name, cnt in counts.items()}, f, indent=2)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,238 @@
+# Copyright 2021 Thea Sommerschield, Jonathan Prag,
+# Marita Chatzipanagiotou, John Pavlopoulos, Ion Androutsopoulos,
+# University of Oxford, DeepMind Technologies Limited, Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''Corpus statistics of the I.PHI dataset.
+
+  python -m train.data.iphi_stats --dataset=train/data/iphi.json
+'''
+
+import argparse
+import itertools
+import json
+import time
+
+import numpy as np
+
+from ithaca.util.alphabet import GreekAlphabet
+from train.data.iphi_record import NO_DATE
+from train.data.iphi_record import read_phi_records
+from train.data.iphi_record import records_to_array
+
+
+p = argparse.ArgumentParser(prog='I.PHI stats',
+                            description='I.PHI corpus statistics.')
+p.add_argument('--dataset', default='train/data/iphi.json', type=str,
+               help='input dataset')
+p.add_argument('--output_json', default='train/data/iphi-stats.json',
+               type=str, help='output json report')
+p.add_argument('--output_npz', default='train/data/iphi-stats.npz',
+               type=str, help='output npz arrays')
+p.add_argument('--batch_size', default=4096, type=int, metavar='N',
+               help='records per batch')
+
+
+def encode_table(alphabet):
+  '''Lookup table from unicode code points to `alphabet.char2idx` indices.
+
+  Characters outside the vocabulary map to `alphabet.unk_idx`, except for the
+  guess brackets which map to the two indices after the vocabulary. The last
+  entry of the table catches every code point beyond it.
+  '''
+  chars = dict(alphabet.char2idx)
+  chars[alphabet.sog] = alphabet.size_char()
+  chars[alphabet.eog] = alphabet.size_char() + 1
+  table = np.full(max(map(ord, chars)) + 2, alphabet.unk_idx, dtype=np.int32)
+  for c, idx in chars.items():
+    table[ord(c)] = idx
+  return table
+
+
+def encode_texts(texts, table, sep):
+  '''Encodes texts into one index array, each text followed by `sep`.'''
+  joined = sep.join(texts) + sep
+  cps = np.frombuffer(joined.encode('utf-32-le'), dtype='<u4')
+  return table[np.minimum(cps, len(table) - 1)]
+
+
+def _add_bincount(acc, values, weights=None):
+  '''Adds a bincount to an accumulator array, growing it as needed.'''
+  counts = np.bincount(values, weights=weights)
+  if len(counts) > len(acc):
+    acc = np.pad(acc, (0, len(counts) - len(acc)))
+  acc[:len(counts)] += counts.astype(acc.dtype)
+  return acc
+
+
+class CorpusStats:
+  '''Accumulates corpus statistics over batches of records.'''
+
+  def __init__(self, alphabet, missing_ratio_bins=20, century=100):
+    self.alphabet = alphabet
+    self.table = encode_table(alphabet)
+    self.missing_idx = alphabet.char2idx[alphabet.missing]
+    self.century = century
+
+    self.records = 0
+    self.char_counts = np.zeros(alphabet.size_char() + 2, dtype=np.int64)
+    self.length_counts = np.zeros(1, dtype=np.int64)
+    self.missing_ratio_edges = np.linspace(0, 1, missing_ratio_bins + 1)
+    self.missing_ratio_counts = np.zeros(missing_ratio_bins, dtype=np.int64)
+    self.lacuna_counts = np.zeros(1, dtype=np.int64)
+    self.region_ids = {}
+    self.region_century = {}
+
+  def update(self, records):
+    '''Adds a batch of records.'''
+    if not records:
+      return
+    self.records += len(records)
+
+    # Encode the whole batch at once; the pad index separates the texts
+    texts = [r.text for r in records]
+    idx = encode_texts(texts, self.table, self.alphabet.pad)
+    self.char_counts = _add_bincount(self.char_counts, idx)
+    self.char_counts[self.alphabet.pad_idx] -= len(texts)
+
+    # Text lengths, counting the separator in each segment
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    self.length_counts = _add_bincount(self.length_counts, lengths)
+    starts = np.concatenate([[0], np.cumsum(lengths + 1)[:-1]])
+
+    # Missing character ratio per text
+    missing = idx == self.missing_idx
+    n_missing = np.add.reduceat(missing, starts, dtype=np.int64)
+    ratio = n_missing / np.maximum(lengths, 1)
+    self.missing_ratio_counts += np.histogram(
+        ratio, bins=self.missing_ratio_edges)[0]
+
+    # Lacuna lengths from runs of missing characters
+    edges = np.diff(np.concatenate([[0], missing.view(np.int8), [0]]))
+    run_lengths = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+    self.lacuna_counts = _add_bincount(self.lacuna_counts, run_lengths)
+
+    # Inscriptions per main region and century of the date midpoint
+    columns = records_to_array(records)
+    regions = np.array(
+        [self.region_ids.setdefault(int(r), len(self.region_ids))
+         for r in columns['region_main_id']], dtype=np.int64)
+    dated = (columns['date_min'] != NO_DATE) & (columns['date_max'] != NO_DATE)
+    midpoint = (columns['date_min'][dated].astype(np.float64) +
+                columns['date_max'][dated]) / 2
+    centuries = np.full(len(records), np.iinfo(np.int64).min)
+    centuries[dated] = (np.floor(midpoint / self.century) *
+                        self.century).astype(np.int64)
+    keys, counts = np.unique(np.stack([regions, centuries], axis=1), axis=0,
+                             return_counts=True)
+    for (region, century), count in zip(keys.tolist(), counts.tolist()):
+      key = (region, century)
+      self.region_century[key] = self.region_century.get(key, 0) + count
+
+  def arrays(self):
+    '''Returns the statistics as numpy arrays.'''
+    region_labels = np.array([str(r) for r in self.region_ids], dtype=str)
+    centuries = sorted({c for _, c in self.region_century})
+    century_idx = {c: i for i, c in enumerate(centuries)}
+    region_century = np.zeros((len(region_labels), len(centuries)),
+                              dtype=np.int64)
+    for (region, century), count in self.region_century.items():
+      region_century[region, century_idx[century]] = count
+
+    undated = np.iinfo(np.int64).min
+    century_labels = np.array(
+        ['undated' if c == undated else str(c) for c in centuries], dtype=str)
+    char_labels = np.array(
+        list(self.alphabet.idx2char) + [self.alphabet.sog, self.alphabet.eog],
+        dtype=str)
+    return {
+        'char_labels': char_labels,
+        'char_counts': self.char_counts,
+        'length_counts': self.length_counts,
+        'missing_ratio_edges': self.missing_ratio_edges,
+        'missing_ratio_counts': self.missing_ratio_counts,
+        'lacuna_length_counts': self.lacuna_counts,
+        'region_labels': region_labels,
+        'century_labels': century_labels,
+        'region_century_counts': region_century,
+    }
+
+  def report(self):
+    '''Returns a JSON serialisable summary of the statistics.'''
+    arrays = self.arrays()
+    lengths = np.arange(len(self.length_counts))
+    total_chars = int(np.dot(lengths, self.length_counts))
+    missing = int(self.char_counts[self.missing_idx])
+    lacunae = np.arange(len(self.lacuna_counts))
+    return {
+        'records': self.records,
+        'chars': total_chars,
+        'char_counts': {
+            c: int(n) for c, n in zip(arrays['char_labels'],
+                                      self.char_counts) if n},
+        'text_length': {
+            'mean': total_chars / max(self.records, 1),
+            'max': int(np.flatnonzero(self.length_counts)[-1])
+                   if self.records else 0,
+            'counts': {int(l): int(n) for l, n in zip(
+                lengths, self.length_counts) if n},
+        },
+        'missing_ratio': {
+            'total': missing / max(total_chars, 1),
+            'edges': self.missing_ratio_edges.tolist(),
+            'counts': self.missing_ratio_counts.tolist(),
+        },
+        'lacuna_length': {
+            'lacunae': int(self.lacuna_counts.sum()),
+            'mean': float(np.dot(lacunae, self.lacuna_counts) /
+                          max(self.lacuna_counts.sum(), 1)),
+            'counts': {int(l): int(n) for l, n in zip(
+                lacunae, self.lacuna_counts) if n},
+        },
+        'region_century': {
+            region: {c: int(n) for c, n in zip(
+                arrays['century_labels'], row) if n}
+            for region, row in zip(arrays['region_labels'],
+                                   arrays['region_century_counts'])
+        },
+    }
+
+
+def batches(iterable, size):
+  '''Splits an iterable into lists of at most `size` items.'''
+  it = iter(iterable)
+  while True:
+    batch = list(itertools.islice(it, size))
+    if not batch:
+      return
+    yield batch
+
+
+def main():
+  flags = p.parse_args()
+  start = time.time()
+
+  stats = CorpusStats(GreekAlphabet())
+  for batch in batches(read_phi_records(flags.dataset), flags.batch_size):
+    stats.update(batch)
+
+  with open(flags.output_json, 'w') as f:
+    json.dump(stats.report(), f, ensure_ascii=False, indent=2)
+  np.savez_compressed(flags.output_npz, **stats.arrays())
+
+  print('Records:', stats.records)
+  print('Time: {:.2f}s'.format(time.time() - start))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,193 @@
+# Copyright 2021 Thea Sommerschield, Jonathan Prag,
+# Marita Chatzipanagiotou, John Pavlopoulos, Ion Androutsopoulos,
+# University of Oxford, DeepMind Technologies Limited, Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+'''Long-running worker that processes PHI pages on demand.
+
+The alphabet, the text cleaners and the HTML parser are loaded once, then
+requests are read as JSON lines from stdin (or from connections to a Unix
+socket with --socket) and answered with one JSON line each:
+
+  {"id": 1, "items": [{"phi_id": 1234}, {"phi_id": 5678, "html": "..."}]}
+
+Items with `html` are parsed as given, the others are downloaded. The reply
+holds one result per item with its record (or null and an error) and the
+fetch/parse times, plus the total time of the request:
+
+  {"id": 1, "results": [{"phi_id": 1234, "record": {...}, "fetch_ms": 310.2,
+   "parse_ms": 8.1}, ...], "total_ms": 330.5}
+
+A single item may also be sent without the `items` list.
+'''
+
+import argparse
+import json
+import os
+import socketserver
+import stat
+import sys
+import time
+
+import requests
+
+from ithaca.util.alphabet import GreekAlphabet
+from train.data.iphi_page import fetch_phi_page
+from train.data.iphi_page import parse_phi_page
+from train.data.iphi_page import PHI_URL
+
+
+p = argparse.ArgumentParser(prog='I.PHI worker',
+                            description='I.PHI page processing worker.')
+p.add_argument('--socket', default='', type=str,
+               help='unix socket path; reads stdin if not given')
+p.add_argument('--timeout', default=5, type=int, metavar='N',
+               help='seconds to timeout')
+p.add_argument('--max_retries_per_inscription', default=10,
+               type=int, metavar='N', help='maximum retries per inscription')
+p.add_argument('--min_text_len', default=10, type=int, metavar='N',
+               help='minimum text length')
+p.add_argument('--phi_url', default=PHI_URL, type=str,
+               help='inscription url template')
+
+WARMUP_PAGE = '''<html><body>
+<div class="hdr1"><a href="/regions/">Regions</a>
+<a href="/regions/1701">Attica (IG I-III)</a><a href="/regions/1702">Attica</a>
+</div><span class="ti">Att. — Ath.: Akr. — 4th c. BC</span>
+<table class="grk"><tr><td class="id">1</td>
+<td>[ἔδοξεν τῆι βουλῆι καὶ τῶι δήμωι — — —] 〚ΔΔ〛 vacat</td></tr>
+</table></body></html>'''
+
+
+def _ms(seconds):
+  return round(seconds * 1000, 3)
+
+
+class PhiWorker:
+  '''Processes PHI ids or pages with a warm alphabet and HTTP session.'''
+
+  def __init__(self, timeout=5, max_retries=10, min_text_len=10, url=PHI_URL):
+    self.timeout = timeout
+    self.max_retries = max_retries
+    self.min_text_len = min_text_len
+    self.url = url
+    self.alphabet = GreekAlphabet()
+    self.client = requests.Session()
+    self.headers = {
+        'User-Agent': 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+    }
+
+    # Run the whole pipeline once so the parser, the compiled cleaner
+    # patterns and the sentence tokenizer are loaded before the first request
+    parse_phi_page(WARMUP_PAGE, 0, self.alphabet)
+
+  def process_item(self, item):
+    '''Processes one {"phi_id", "html"} item.'''
+    phi_id = item.get('phi_id')
+    result = {'phi_id': phi_id, 'record': None}
+    html = item.get('html')
+
+    start = time.monotonic()
+    if html is None:
+      if phi_id is None:
+        result['error'] = 'item needs a phi_id or html'
+        return result
+      html = fetch_phi_page(phi_id, self.client, self.headers, self.timeout,
+                            max_retries=self.max_retries, url=self.url)
+      result['fetch_ms'] = _ms(time.monotonic() - start)
+      if html is None:
+        result['error'] = 'fetch failed'
+        return result
+
+    start = time.monotonic()
+    try:
+      record = parse_phi_page(html, phi_id, self.alphabet)
+    except Exception as e:
+      result['error'] = 'parse failed: {!r}'.format(e)
+      return result
+    finally:
+      result['parse_ms'] = _ms(time.monotonic() - start)
+
+    if record is None:
+      result['error'] = 'invalid PHI inscription number'
+    elif len(record.text.replace(self.alphabet.missing,
+                                 '')) < self.min_text_len:
+      result['error'] = 'text too short'
+    else:
+      result['record'] = record.to_dict()
+    return result
+
+  def handle(self, line):
+    '''Answers one JSON request line with one JSON reply line.'''
+    start = time.monotonic()
+    try:
+      request = json.loads(line)
+    except ValueError as e:
+      return json.dumps({'error': 'invalid json: {}'.format(e)})
+    if not isinstance(request, dict):
+      return json.dumps({'error': 'request must be a json object'})
+
+    items = request.get('items', [request])
+    if not isinstance(items, list) or not all(
+        isinstance(item, dict) for item in items):
+      return json.dumps({'id': request.get('id'),
+                         'error': 'items must be a list of json objects'})
+    reply = {'id': request.get('id'),
+             'results': [self.process_item(item) for item in items]}
+    reply['total_ms'] = _ms(time.monotonic() - start)
+    return json.dumps(reply, ensure_ascii=False)
+
+
+def serve_stdio(worker, stdin=sys.stdin, stdout=sys.stdout):
+  for line in stdin:
+    if line.strip():
+      stdout.write(worker.handle(line) + '\n')
+      stdout.flush()
+
+
+def serve_socket(worker, path):
+  class Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+      for line in self.rfile:
+        if line.strip():
+          self.wfile.write((worker.handle(line.decode('utf-8')) +
+                            '\n').encode('utf-8'))
+          self.wfile.flush()
+
+  # Replace a stale socket, but never remove anything else
+  if os.path.exists(path):
+    if not stat.S_ISSOCK(os.stat(path).st_mode):
+      raise ValueError('{} exists and is not a socket.'.format(path))
+    os.remove(path)
+  with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+    print('Serving on', path, file=sys.stderr)
+    server.serve_forever()
+
+
+def main():
+  flags = p.parse_args()
+  start = time.monotonic()
+  worker = PhiWorker(timeout=flags.timeout,
+                     max_retries=flags.max_retries_per_inscription,
+                     min_text_len=flags.min_text_len, url=flags.phi_url)
+  print('Ready in {:.2f}s'.format(time.monotonic() - start), file=sys.stderr)
+
+  if flags.socket:
+    serve_socket(worker, flags.socket)
+  else:
+    serve_stdio(worker)
+
+
+if __name__ == '__main__':
+  main()